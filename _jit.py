@@ -0,0 +1,8 @@
+# _jit.py - Numba's njit, or a no-op stand-in when Numba isn't installed
+
+try:
+    from numba import njit
+except ImportError:
+    # Numba not installed - run the decorated code as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
@@ -0,0 +1,60 @@
+# _pid_kernel.py - Numba-compiled arithmetic of one PID controller update
+
+from _jit import njit
+
+
+@njit(cache=True)
+def pid_step(filtered_temp, target_temp, kp, ki, kd, dt,
+             error_sum, last_temp, d_filt, prev_error_sign,
+             deadband, max_integral, reset_integral_threshold, conditional_integration,
+             inv_sample_time, d_alpha):
+    """
+    Deadband, P/I/D terms and the integral anti-windup strategies for one update.
+
+    The derivative is taken on the measurement (last_temp is the previous
+    filtered temperature) to avoid derivative kick. It assumes the nominal
+    sample time (inv_sample_time = 1 / update interval) rather than the
+    measured dt, and is smoothed by a one-pole low-pass with coefficient
+    d_alpha; d_filt is that filter's state.
+
+    Returns (error_sum, d_filt, error_sign, output, integral_reset, error,
+    deadband_error, p_term, i_term, d_term); the last five are only used
+    for logging.
+    """
+    error = target_temp - filtered_temp
+
+    # Deadband: no action on small errors, otherwise shrink magnitude by the deadband
+    if abs(error) < deadband:
+        deadband_error = 0.0
+    else:
+        deadband_error = error - (deadband * (1 if error > 0 else -1))
+
+    p_term = kp * deadband_error
+
+    # Strategy 1: reset the integral if the error changed sign significantly
+    error_sign = 1 if error > 0 else (-1 if error < 0 else 0)
+    integral_reset = False
+    if prev_error_sign != 0 and error_sign != 0 and prev_error_sign != error_sign:
+        if abs(error) > reset_integral_threshold:
+            error_sum = 0.0
+            integral_reset = True
+
+    # Strategy 2: conditional integration (only integrate when P term isn't saturated)
+    if not conditional_integration or abs(p_term) < 20:
+        error_sum += error * dt
+
+    # Strategy 3: clamp the integral term
+    error_sum = max(-max_integral, min(error_sum, max_integral))
+    i_term = ki * error_sum
+
+    raw_d = (filtered_temp - last_temp) * inv_sample_time
+    d_filt += d_alpha * (raw_d - d_filt)
+    d_term = -kd * d_filt
+
+    output = p_term + i_term + d_term
+
+    return error_sum, d_filt, error_sign, output, integral_reset, error, deadband_error, p_term, i_term, d_term
+
+
+# Warm up at import so the first control tick doesn't pay the JIT compile
+pid_step(50.0, 60.0, 1.0, 0.1, 0.1, 0.5, 0.0, 50.0, 0.0, 0, 0.5, 15.0, 8.0, True, 2.0, 0.5)
@@ -0,0 +1,80 @@
+# _sim_kernel.py - Numba-compiled numeric core of the boiler simulation step
+
+import math
+
+from _jit import njit
+
+
+@njit(cache=True, fastmath=True, nogil=True)
+def step(temperature, heater_on, dt, t,
+         room_temp, max_temp, heater_power, heater_variability, cooling_rate,
+         thermal_inertia, oscillation_phase, oscillation_amplitude, oscillation_period,
+         convection_currents, time_phasors, phasor_step, last_disturbance_time, random_max,
+         u_heater, u_interval, u_disturbance):
+    """
+    Advance the boiler physics by one step of dt minutes.
+
+    Everything is passed in as plain floats (Numba freezes module globals at
+    compile time, so the API-adjustable parameters can't be read from app.py),
+    and the three uniforms in [0, 1) are drawn by the caller.
+
+    time_phasors is (sin(t/3), cos(t/3), sin(t/7), cos(t/7)) for the current
+    t; phasor_step holds the same four values for one time step. The phasors
+    are rotated forward by one step here rather than recomputed with libm.
+
+    The kernel is pure (no Python objects), so it runs with the GIL released
+    and doesn't block Flask request threads while it computes.
+
+    Returns (temperature, oscillation_phase, convection_currents,
+    time_phasors, last_disturbance_time, random_disturbance).
+    """
+    # Heating (with non-linear effects and variability)
+    if heater_on:
+        heater_efficiency = 1.0 - (heater_variability * (0.5 - u_heater))
+        heat_rate = heater_power * heater_efficiency * (1 - (temperature / max_temp) ** 2)
+        heat_rate *= (1.0 - 0.3 * math.sin(temperature / 10.0))
+        temp_change = heat_rate * dt
+    else:
+        temp_change = 0.0
+
+    # Cooling, proportional to difference from room temp with non-linearity
+    cooling_factor = cooling_rate * (1 + 0.2 * math.sin(temperature / 15.0))
+    cooling = cooling_factor * (temperature - room_temp) * dt
+
+    # Thermal inertia (resistance to temperature change)
+    temp_change = temp_change / thermal_inertia
+    cooling = cooling / thermal_inertia
+
+    # Oscillatory behavior (simulating convection currents)
+    oscillation_phase += dt * 60 * (2 * math.pi / oscillation_period)
+    oscillation = oscillation_amplitude * math.sin(oscillation_phase)
+
+    # Random disturbances every ~10-15 seconds of simulation time
+    random_disturbance = 0.0
+    if (t - last_disturbance_time) > (10 + 5 * u_interval):
+        random_disturbance = (u_disturbance * 2 - 1) * random_max
+        last_disturbance_time = t
+
+    # Convection currents
+    sin_3, cos_3, sin_7, cos_7 = time_phasors
+    convection_currents = 0.8 * convection_currents + 0.2 * (
+        0.5 * sin_3 - 0.3 * cos_7
+    )
+    convection_effect = convection_currents * 0.8
+
+    # Advance sin/cos of t/3 and t/7 by one step using the angle-addition identities
+    step_sin_3, step_cos_3, step_sin_7, step_cos_7 = phasor_step
+    time_phasors = (sin_3 * step_cos_3 + cos_3 * step_sin_3,
+                    cos_3 * step_cos_3 - sin_3 * step_sin_3,
+                    sin_7 * step_cos_7 + cos_7 * step_sin_7,
+                    cos_7 * step_cos_7 - sin_7 * step_sin_7)
+
+    temperature = temperature + temp_change - cooling + oscillation + random_disturbance + convection_effect
+
+    return (temperature, oscillation_phase, convection_currents, time_phasors,
+            last_disturbance_time, random_disturbance)
+
+
+# Warm up at import so the first simulation tick doesn't pay the JIT compile
+step(20.0, True, 0.001, 0.0, 20.0, 100.0, 3.0, 0.1, 0.05, 4.0, 0.0, 0.3, 10.0, 0.0,
+     (0.0, 1.0, 0.0, 1.0), (0.0, 1.0, 0.0, 1.0), 0.0, 0.5, 0.5, 0.5, 0.5)
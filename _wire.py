@@ -0,0 +1,11 @@
+# _wire.py - Binary wire format shared by /api/tick.bin and the PID controller
+
+import struct
+
+# Reply to POST /api/tick.bin, little-endian:
+# current_temp, target_temp, auto_control, kp, ki, kd
+PID_STATE = struct.Struct('<dd?ddd')
+
+# Request body: one byte, 0x00 = heater off, 0x01 = heater on (empty = no command)
+HEATER_OFF = b'\x00'
+HEATER_ON = b'\x01'
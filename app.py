@@ -1,13 +1,25 @@
 # app.py - Modified Flask application for the boiler simulation with added instability
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
+from flask_orjson import OrjsonProvider
 import time
 import threading
-import json
+import argparse
+import heapq
+import itertools
+import logging
 import math
-import random  # Added for random disturbances
+
+import numpy as np
+import orjson
+
+import _sim_kernel
+import _wire
+
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)  # orjson-backed jsonify (much faster float encoding for history)
 
 # Simulation parameters
 ROOM_TEMP = 20.0  # Keep as is
@@ -17,6 +29,7 @@ COOLING_RATE = 0.05  # Reduce from 0.1 for slower cooling
 SIMULATION_INTERVAL = 0.1  # Keep as is
 MAX_HISTORY = 300  # number of data points to keep
 TIME_SPEEDUP = 1.0  # default time speed multiplier (can be changed via API)
+RNG_BATCH = 1024  # uniforms drawn at a time for the random effects
 
 # Instability parameters
 CONTROL_DELAY = 1.0  # Reduce from 2.0 for faster response
@@ -26,6 +39,13 @@ RANDOM_DISTURBANCE_MAX = 0.5  # Reduce for more predictable behavior
 THERMAL_INERTIA = 4.0  # Increase for more damping (more resistance to change)
 HEATER_VARIABILITY = 0.1  # Reduce from 0.3 for more consistent heating
 
+# sin/cos of the per-step angle for the t/3 and t/7 convection terms
+# (state.time always advances by SIMULATION_INTERVAL, whatever the speedup)
+CONVECTION_PHASOR_STEP = (
+    math.sin(SIMULATION_INTERVAL / 3.0), math.cos(SIMULATION_INTERVAL / 3.0),
+    math.sin(SIMULATION_INTERVAL / 7.0), math.cos(SIMULATION_INTERVAL / 7.0)
+)
+
 # Global state
 class BoilerState:
     def __init__(self):
@@ -33,9 +53,18 @@ class BoilerState:
         self.heater_on = False
         self.heater_control_auto = False
         self.target_temp = 60.0
-        self.history = []
-        self.time = 0
-        self.last_update = time.time()
+        
+        # History ring buffers, one array per field
+        self.hist_time = np.zeros(MAX_HISTORY)
+        self.hist_temp = np.zeros(MAX_HISTORY)
+        self.hist_heater = np.zeros(MAX_HISTORY, dtype=np.bool_)
+        self.hist_target = np.zeros(MAX_HISTORY)
+        self.hist_idx = 0  # next slot to write
+        self.hist_count = 0  # number of valid points
+        self.state_json = b''  # latest /api/state body, rebuilt by the sim thread each tick
+        self.settings_json = b''  # encoded pid/time_speedup/instability members of that body
+        self.settings_lock = threading.Lock()
+        self.time = 0.0
         self.time_speedup = TIME_SPEEDUP  # simulation speed multiplier
         
         # PID parameters - these can be adjusted via API
@@ -48,94 +77,132 @@ class BoilerState:
         self.last_error = 0
         
         # Delay queue for control actions
-        self.delayed_actions = []  # (time, action) tuples
+        self.delayed_actions = []  # min-heap of (time, seq, action) tuples
+        self.action_seq = itertools.count()  # tiebreaker keeps same-time actions in order
         
         # System state variables for instability
         self.thermal_inertia = THERMAL_INERTIA  # resistance to temperature change
         self.oscillation_phase = 0.0  # phase of oscillation
         self.last_disturbance_time = 0.0  # time of last random disturbance
+        
+        # Random numbers are drawn in batches and consumed a few per tick
+        self.rng = np.random.default_rng()
+        self.rng_buf = self.rng.random(RNG_BATCH)
+        self.rng_idx = 0
         self.convection_currents = 0.0  # simulated air convection effects
+        self.convection_phasors = (0.0, 1.0, 0.0, 1.0)  # sin/cos of time/3 and time/7
         
 state = BoilerState()
 
 # Simulation thread
 def simulation_loop():
+    # Sleep until a fixed deadline rather than a fixed amount, so time spent
+    # in update_simulation doesn't make the loop drift
+    next_deadline = time.monotonic()
     while True:
         update_simulation()
-        time.sleep(SIMULATION_INTERVAL)
+        next_deadline += SIMULATION_INTERVAL
+        sleep_for = next_deadline - time.monotonic()
+        if sleep_for > 0:
+            time.sleep(sleep_for)
+        else:
+            next_deadline = time.monotonic()  # fell behind, don't try to catch up
+
+def next_uniforms():
+    # Take the three uniforms a tick needs from the batch, refilling it when used up
+    idx = state.rng_idx
+    if idx + 3 > RNG_BATCH:
+        state.rng_buf = state.rng.random(RNG_BATCH)
+        idx = 0
+    state.rng_idx = idx + 3
+    buf = state.rng_buf
+    return buf[idx], buf[idx + 1], buf[idx + 2]
 
 def update_simulation():
-    current_time = time.time()
-    dt = (current_time - state.last_update) / 60.0  # convert to minutes
+    # Fixed step: each call advances the simulation by SIMULATION_INTERVAL
+    dt = SIMULATION_INTERVAL / 60.0  # convert to minutes
     dt = dt * state.time_speedup  # Apply time speedup multiplier
-    state.last_update = current_time
     
     # Process delayed control actions
+    # Only the actions that are due get popped; the rest stay in the heap
     current_sim_time = state.time
-    pending_actions = []
-    for action_time, action_value in state.delayed_actions:
-        if action_time <= current_sim_time:
-            # Apply delayed action
-            state.heater_on = action_value
-        else:
-            # Keep this action for later
-            pending_actions.append((action_time, action_value))
-    state.delayed_actions = pending_actions
+    while state.delayed_actions and state.delayed_actions[0][0] <= current_sim_time:
+        _, _, action_value = heapq.heappop(state.delayed_actions)
+        state.heater_on = action_value
     
-    # Calculate temperature change
-    if state.heater_on:
-        # Heating (with non-linear effects and variability)
-        heater_efficiency = 1.0 - (HEATER_VARIABILITY * (0.5 - random.random()))
-        heat_rate = HEATER_POWER * heater_efficiency * (1 - (state.temperature / MAX_TEMP) ** 2)
-        
-        # Add non-linearity that increases as temperature rises
-        heat_rate *= (1.0 - 0.3 * math.sin(state.temperature / 10.0))
-        
-        temp_change = heat_rate * dt
-    else:
-        temp_change = 0
-    
-    # Cooling (always happens, proportional to difference from room temp)
-    # Added non-linearity to cooling based on current temperature
-    cooling_factor = COOLING_RATE * (1 + 0.2 * math.sin(state.temperature / 15.0))
-    cooling = cooling_factor * (state.temperature - ROOM_TEMP) * dt
-    
-    # Apply thermal inertia (resistance to temperature change)
-    temp_change = temp_change / state.thermal_inertia
-    cooling = cooling / state.thermal_inertia
-    
-    # Add oscillatory behavior (simulating convection currents)
-    state.oscillation_phase += dt * 60 * (2 * math.pi / OSCILLATION_PERIOD)  
-    oscillation = OSCILLATION_AMPLITUDE * math.sin(state.oscillation_phase)
-    
-    # Add random disturbances occasionally (every ~10-15 seconds of simulation time)
-    random_disturbance = 0
-    if (state.time - state.last_disturbance_time) > (10 + 5 * random.random()):
-        random_disturbance = (random.random() * 2 - 1) * RANDOM_DISTURBANCE_MAX
-        state.last_disturbance_time = state.time
-        print(f"Random disturbance: {random_disturbance:.2f}°C at time {state.time:.1f}s")
-    
-    # Update convection currents based on temperature difference and random factors
-    state.convection_currents = 0.8 * state.convection_currents + 0.2 * (
-        0.5 * math.sin(state.time / 3.0) - 0.3 * math.cos(state.time / 7.0)
+    # Heating, cooling, oscillation, random disturbances and convection
+    # are all computed by the compiled kernel (see _sim_kernel.py)
+    last_disturbance_time = state.last_disturbance_time
+    (state.temperature, state.oscillation_phase, state.convection_currents,
+     state.convection_phasors, state.last_disturbance_time, random_disturbance) = _sim_kernel.step(
+        state.temperature, bool(state.heater_on), dt, state.time,
+        ROOM_TEMP, MAX_TEMP, HEATER_POWER, HEATER_VARIABILITY, COOLING_RATE,
+        state.thermal_inertia, state.oscillation_phase, OSCILLATION_AMPLITUDE, OSCILLATION_PERIOD,
+        state.convection_currents, state.convection_phasors, CONVECTION_PHASOR_STEP,
+        last_disturbance_time, RANDOM_DISTURBANCE_MAX,
+        *next_uniforms()
     )
-    convection_effect = state.convection_currents * 0.8
-    
-    # Update temperature with all effects
-    state.temperature = state.temperature + temp_change - cooling + oscillation + random_disturbance + convection_effect
+    if state.last_disturbance_time != last_disturbance_time:
+        log.debug("Random disturbance: %.2f°C at time %.1fs", random_disturbance, state.time)
     
     # Add to history
     state.time += SIMULATION_INTERVAL
-    state.history.append({
-        'time': state.time,
-        'temperature': state.temperature,
-        'heater_on': state.heater_on,
-        'target': state.target_temp
-    })
+    idx = state.hist_idx
+    state.hist_time[idx] = state.time
+    state.hist_temp[idx] = state.temperature
+    state.hist_heater[idx] = state.heater_on
+    state.hist_target[idx] = state.target_temp
+    state.hist_idx = (idx + 1) % MAX_HISTORY
+    state.hist_count = min(state.hist_count + 1, MAX_HISTORY)
     
-    # Trim history if too long
-    if len(state.history) > MAX_HISTORY:
-        state.history = state.history[-MAX_HISTORY:]
+    # Encode the /api/state response here, off the request path. Swapping in
+    # the new bytes object is atomic, so request threads never see a partial update.
+    state.state_json = encode_state()
+
+def history_columns():
+    # Copy the ring buffers out in chronological order
+    order = np.arange(state.hist_idx - state.hist_count, state.hist_idx) % MAX_HISTORY
+    return {
+        'time': state.hist_time[order],
+        'temperature': state.hist_temp[order],
+        'heater_on': state.hist_heater[order],
+        'target': state.hist_target[order]
+    }
+
+def refresh_settings_json():
+    # Re-encode the rarely changing part of /api/state; called after any change to it.
+    # The lock makes the last refresh always see the latest values.
+    with state.settings_lock:
+        state.settings_json = orjson.dumps({
+            'pid': {
+                'kp': state.kp,
+                'ki': state.ki,
+                'kd': state.kd
+            },
+            'time_speedup': state.time_speedup,
+            'instability': {
+                'thermal_inertia': state.thermal_inertia,
+                'oscillation_amplitude': OSCILLATION_AMPLITUDE,
+                'oscillation_period': OSCILLATION_PERIOD,
+                'random_max': RANDOM_DISTURBANCE_MAX,
+                'control_delay': CONTROL_DELAY
+            }
+        })[1:-1]
+
+def encode_state():
+    # History is sent column-wise; orjson dumps the arrays without per-element Python work
+    body = orjson.dumps({
+        'current_temp': state.temperature,
+        'heater_on': state.heater_on,
+        'auto_control': state.heater_control_auto,
+        'target_temp': state.target_temp,
+        'history': history_columns()
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+    # Splice in the cached settings members
+    return body[:-1] + b',' + state.settings_json + b'}'
+
+refresh_settings_json()
+state.state_json = encode_state()
 
 # Modified heater control to include delay
 def set_heater_with_delay(on):
@@ -143,7 +210,7 @@ def set_heater_with_delay(on):
     effect_time = state.time + CONTROL_DELAY
     
     # Add to the delayed actions queue
-    state.delayed_actions.append((effect_time, on))
+    heapq.heappush(state.delayed_actions, (effect_time, next(state.action_seq), on))
     
     # For user feedback, we'll say the heater is in the state they requested
     # even though it hasn't actually changed yet
@@ -167,6 +234,7 @@ def set_simulation_speed():
         # Limit to reasonable values
         speedup = max(1.0, min(50.0, speedup))
         state.time_speedup = speedup
+        refresh_settings_json()
         return jsonify({'success': True, 'time_speedup': state.time_speedup})
     return jsonify({'success': False, 'message': 'Missing speedup parameter'})
 
@@ -180,17 +248,18 @@ def set_instability():
     
     if 'oscillation_amplitude' in data and 'oscillation_period' in data:
         global OSCILLATION_AMPLITUDE, OSCILLATION_PERIOD
-        OSCILLATION_AMPLITUDE = max(0, float(data['oscillation_amplitude']))
+        OSCILLATION_AMPLITUDE = max(0.0, float(data['oscillation_amplitude']))
         OSCILLATION_PERIOD = max(0.1, float(data['oscillation_period']))
     
     if 'random_max' in data:
         global RANDOM_DISTURBANCE_MAX
-        RANDOM_DISTURBANCE_MAX = max(0, float(data['random_max']))
+        RANDOM_DISTURBANCE_MAX = max(0.0, float(data['random_max']))
     
     if 'control_delay' in data:
         global CONTROL_DELAY
-        CONTROL_DELAY = max(0, float(data['control_delay']))
+        CONTROL_DELAY = max(0.0, float(data['control_delay']))
     
+    refresh_settings_json()
     return jsonify({
         'success': True,
         'thermal_inertia': state.thermal_inertia,
@@ -207,24 +276,20 @@ def index():
 
 @app.route('/api/state')
 def get_state():
+    # Body is pre-encoded by the simulation thread after every tick
+    return Response(state.state_json, mimetype='application/json')
+
+@app.route('/api/pid_state')
+def get_pid_state():
+    # Just what the external PID controller needs - no history
     return jsonify({
         'current_temp': state.temperature,
-        'heater_on': state.heater_on,
-        'auto_control': state.heater_control_auto,
         'target_temp': state.target_temp,
-        'history': state.history,
+        'auto_control': state.heater_control_auto,
         'pid': {
             'kp': state.kp,
             'ki': state.ki,
             'kd': state.kd
-        },
-        'time_speedup': state.time_speedup,
-        'instability': {
-            'thermal_inertia': state.thermal_inertia,
-            'oscillation_amplitude': OSCILLATION_AMPLITUDE,
-            'oscillation_period': OSCILLATION_PERIOD,
-            'random_max': RANDOM_DISTURBANCE_MAX,
-            'control_delay': CONTROL_DELAY
         }
     })
 
@@ -234,9 +299,32 @@ def control_heater():
     if 'on' in data:
         # Apply control with delay
         heater_on = set_heater_with_delay(data['on'])
-        print(f"Heater will be set to {'ON' if heater_on else 'OFF'} after delay")
+        log.debug("Heater will be set to %s after delay", 'ON' if heater_on else 'OFF')
     return jsonify({'success': True, 'heater_on': state.heater_on})
 
+@app.route('/api/tick', methods=['POST'])
+def control_tick():
+    # One round-trip per PID controller cycle: apply its heater command, if any,
+    # and reply with the state it needs for the next decision
+    data = request.json
+    if data.get('on') is not None:
+        set_heater_with_delay(data['on'])
+    return get_pid_state()
+
+@app.route('/api/tick.bin', methods=['POST'])
+def control_tick_bin():
+    # Same as /api/tick with the fixed binary layout from _wire.py instead of JSON
+    command = request.get_data()
+    if command == _wire.HEATER_ON or command == _wire.HEATER_OFF:
+        set_heater_with_delay(command == _wire.HEATER_ON)
+    elif command:
+        return Response(status=400)  # not a heater command - don't touch the actuator
+    body = _wire.PID_STATE.pack(
+        state.temperature, state.target_temp, state.heater_control_auto,
+        state.kp, state.ki, state.kd
+    )
+    return Response(body, mimetype='application/octet-stream')
+
 @app.route('/api/auto_control', methods=['POST'])
 def set_auto_control():
     data = request.json
@@ -264,11 +352,23 @@ def set_pid():
         state.ki = float(data['ki'])
     if 'kd' in data:
         state.kd = float(data['kd'])
+    refresh_settings_json()
     return jsonify({'success': True, 'pid': {'kp': state.kp, 'ki': state.ki, 'kd': state.kd}})
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Boiler simulation server")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Log heater commands and random disturbances")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    
     # Start simulation thread
     sim_thread = threading.Thread(target=simulation_loop, daemon=True)
     sim_thread.start()
     
-    app.run(host='0.0.0.0', debug=True, threaded=True)
\ No newline at end of file
+    # Production WSGI server instead of the Werkzeug debug server/reloader
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=5000, threads=8)
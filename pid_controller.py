@@ -1,24 +1,90 @@
 # pid_controller.py - Enhanced PID controller with improved anti-windup protection
 
-import requests
+import asyncio
+import httpx
 import time
 import sys
-import json
 import argparse
+import logging
+import logging.handlers
+import queue
 import signal
-from collections import deque
+import socket
+import struct
+from typing import NamedTuple
+
+import orjson
+
+import _wire
+from _pid_kernel import pid_step
+
+log = logging.getLogger(__name__)
 
 # Default configuration
 DEFAULT_URL = 'http://127.0.0.1:5000'  # Flask app URL
 DEFAULT_UPDATE_INTERVAL = 0.5  # seconds
 
+# Per-tick debug output, emitted as a single log record
+TICK_LOG_FORMAT = (
+    "Current: %.2f°C (Filtered: %.2f°C), Target: %.2f°C\n"
+    "Error: %.2f°C, Deadband Error: %.2f°C\n"
+    "P: %.2f, I: %.2f (sum=%.2f), D: %.2f\n"
+    "Raw Output: %.2f, Filtered Output: %.2f\n"
+    "Decision: Heater %s (State Duration: %.1fs)%s\n"
+    + "-" * 40
+)
+
+
+class State(NamedTuple):
+    """
+    Simulation state as seen by the controller
+    """
+    current_temp: float
+    target_temp: float
+    auto_control: bool
+    kp: float
+    ki: float
+    kd: float
+
+
 class PIDController:
     def __init__(self, base_url, update_interval=DEFAULT_UPDATE_INTERVAL, 
-                filter_samples=5, deadband=0.5, min_heater_duration=0.5):
+                filter_samples=5, deadband=0.5, min_heater_duration=0.5, http2=False):
         self.base_url = base_url
         self.update_interval = update_interval
         self.running = False
         
+        # One async client with a small keep-alive pool. HTTP/2 is only
+        # negotiated over TLS (e.g. an https:// reverse proxy in front of the app);
+        # against the plain-HTTP waitress server the client stays on HTTP/1.1.
+        # TCP_NODELAY keeps the tiny POSTs from waiting on Nagle/delayed ACK, and
+        # the short timeouts stop a stalled server from hanging the loop.
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=httpx.Limits(max_keepalive_connections=4, max_connections=8),
+            socket_options=[
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+        )
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            transport=transport,
+            timeout=httpx.Timeout(0.2, connect=0.1),
+            headers={"Accept": "application/json"}
+        )
+        
+        # Paths and request bodies never change, so build them once
+        self._state_url = "/api/pid_state"
+        self._heater_url = "/api/heater"
+        self._auto_url = "/api/auto_control"
+        self._tick_url = "/api/tick.bin"
+        self._heater_bodies = (orjson.dumps({"on": False}), orjson.dumps({"on": True}))  # indexed by the bool
+        self._auto_body = orjson.dumps({"enabled": True})
+        self._tick_bodies = {None: b'', False: _wire.HEATER_OFF, True: _wire.HEATER_ON}
+        self._json_headers = {"Content-Type": "application/json"}
+        self._binary_headers = {"Content-Type": "application/octet-stream", "Accept": "application/octet-stream"}
+        
         # Enhanced PID configuration
         self.filter_samples = filter_samples
         self.deadband = deadband
@@ -29,216 +95,319 @@ class PIDController:
         self.reset_integral_threshold = 8.0  # Reset integral if error crosses zero by this amount
         self.conditional_integration = True  # Only integrate when P term isn't saturated
         
+        # Derivative term uses the nominal sample time (the loop runs on a fixed
+        # deadline) and a one-pole low-pass with time constant derivative_tau
+        self.derivative_tau = 1.0  # seconds
+        self._inv_dt = 1.0 / update_interval
+        self._d_alpha = update_interval / (self.derivative_tau + update_interval)
+        
         # Initialize PID state
-        self.error_sum = 0
-        self.last_error = 0
-        self.last_time = time.time()
-        self.recent_temps = deque(maxlen=filter_samples)
-        self.recent_outputs = deque(maxlen=3)
+        self.error_sum = 0.0
+        self.last_error = None  # previous filtered temperature (derivative is on measurement)
+        self._d_filt = 0.0  # low-passed derivative of the filtered temperature
+        self.last_time = time.monotonic()
+        # Single-pole IIR filter state (None until the first sample arrives)
+        self.temp_alpha = 2.0 / (filter_samples + 1)  # EMA equivalent of an N-sample moving average
+        self.output_alpha = 0.5
+        self.t_filt = None
+        self.y_filt = None
         self.heater_state_duration = 0
         self.last_heater_state = False
         self.prev_error_sign = 0  # Track error sign for sign change detection
         
-    def get_state(self):
+        # Unchanged heater decisions aren't re-sent, except every
+        # command_resend_ticks ticks in case an earlier command was lost
+        self.command_resend_ticks = 20
+        self._last_cmd = None
+        self._ticks_since_cmd = 0
+        
+        # Connections opened before the loop starts, and kept from idling out
+        # on the server by a HEAD every keepalive_interval seconds
+        self.warm_connections = 2
+        self.keepalive_interval = 30.0
+        
+    async def get_state(self):
         try:
-            response = requests.get(f"{self.base_url}/api/state")
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error fetching state: {e}")
+            response = await self.client.get(self._state_url)
+            if response.status_code != 200:
+                log.warning("Error fetching state: HTTP %d", response.status_code)
+                return None
+            d = orjson.loads(response.content)
+            pid = d['pid']
+            return State(d['current_temp'], d['target_temp'], d['auto_control'],
+                         pid['kp'], pid['ki'], pid['kd'])
+        except (httpx.HTTPError, orjson.JSONDecodeError, KeyError, TypeError) as e:
+            log.warning("Error fetching state: %s", e)
             return None
     
-    def set_heater(self, on):
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/heater",
-                json={"on": on}
-            )
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error setting heater: {e}")
-            return None
+    async def preconnect(self):
+        """
+        Open warm_connections pooled connections at once, so no tick pays for a TCP handshake
+        """
+        results = await asyncio.gather(
+            *(self.client.head(self._state_url) for _ in range(self.warm_connections)),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                log.warning("Error opening connection: %s", result)
     
-    def filter_temperature(self, current_temp):
+    async def keepalive(self):
         """
-        Apply a moving average filter to reduce noise in temperature readings
+        Periodically re-warm the pool for as long as the controller runs
         """
-        self.recent_temps.append(current_temp)
-        return sum(self.recent_temps) / len(self.recent_temps)
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            await self.preconnect()
     
-    def filter_output(self, output):
+    async def tick(self, heater_on):
         """
-        Apply a filter to smooth control output and prevent rapid oscillations
+        Send the heater decision (None for no command) and get the new state in one round-trip
         """
-        self.recent_outputs.append(output)
-        # Weighted average with more weight on recent outputs
-        if len(self.recent_outputs) == 3:
-            return 0.5 * self.recent_outputs[-1] + 0.3 * self.recent_outputs[-2] + 0.2 * self.recent_outputs[-3]
-        elif len(self.recent_outputs) == 2:
-            return 0.7 * self.recent_outputs[-1] + 0.3 * self.recent_outputs[-2]
-        else:
-            return output
+        try:
+            response = await self.client.post(
+                self._tick_url,
+                content=self._tick_bodies[heater_on],
+                headers=self._binary_headers
+            )
+            if response.status_code != 200:
+                log.warning("Error exchanging control tick: HTTP %d", response.status_code)
+                return None
+            return State._make(_wire.PID_STATE.unpack(response.content))
+        except (httpx.HTTPError, struct.error) as e:
+            log.warning("Error exchanging control tick: %s", e)
+            return None
     
-    def apply_deadband(self, error):
+    async def set_heater(self, on):
+        try:
+            response = await self.client.post(
+                self._heater_url,
+                content=self._heater_bodies[bool(on)],
+                headers=self._json_headers
+            )
+            if response.status_code != 200:
+                log.warning("Error setting heater: HTTP %d", response.status_code)
+                return None
+            return orjson.loads(response.content)
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+            log.warning("Error setting heater: %s", e)
+            return None
+    
+    def filter_temperature(self, current_temp):
         """
-        Apply deadband to error to prevent control action on small errors
+        Apply an exponential moving average to reduce noise in temperature readings
         """
-        if abs(error) < self.deadband:
-            return 0
+        if self.t_filt is None:
+            self.t_filt = current_temp
         else:
-            # Preserve sign but reduce magnitude by deadband
-            return error - (self.deadband * (1 if error > 0 else -1))
+            self.t_filt += self.temp_alpha * (current_temp - self.t_filt)
+        return self.t_filt
     
-    def manage_integral_term(self, error, p_term, dt):
+    def filter_output(self, output):
         """
-        Enhanced integral management with multiple anti-windup strategies
+        Apply a single-pole IIR filter to smooth control output and prevent rapid oscillations
         """
-        # Strategy 1: Check for error sign change (indicating setpoint crossing)
-        current_sign = 1 if error > 0 else (-1 if error < 0 else 0)
-        if self.prev_error_sign != 0 and current_sign != 0 and self.prev_error_sign != current_sign:
-            # If error has changed sign and is significant, reset integral
-            if abs(error) > self.reset_integral_threshold:
-                print(f"🔄 Error changed sign significantly ({self.prev_error_sign} to {current_sign}). Resetting integral term.")
-                self.error_sum = 0
-        self.prev_error_sign = current_sign
-        
-        # Strategy 2: Conditional integration (only integrate when P term isn't saturated)
-        # This prevents integral wind-up when the controller can't affect the process
-        if not self.conditional_integration or abs(p_term) < 20:
-            # Only accumulate integral within reasonable range
-            self.error_sum += error * dt
-            
-        # Strategy 3: Clamp the integral term to prevent excessive wind-up
-        self.error_sum = max(-self.max_integral, min(self.error_sum, self.max_integral))
-        
-        return self.error_sum
+        if self.y_filt is None:
+            self.y_filt = output
+        else:
+            self.y_filt = self.output_alpha * output + (1 - self.output_alpha) * self.y_filt
+        return self.y_filt
     
     def pid_calculation(self, state):
         """
         Calculates PID output with enhanced anti-windup protection
         """
         # Extract values from state
-        current_temp = state['current_temp']
-        target_temp = state['target_temp']
-        kp = state['pid']['kp']
-        ki = state['pid']['ki']
-        kd = state['pid']['kd']
+        current_temp, target_temp, _, kp, ki, kd = state
         
         # Filter temperature to reduce noise
         filtered_temp = self.filter_temperature(current_temp)
         
         # Calculate time delta
-        current_time = time.time()
-        dt = current_time - self.last_time
-        self.last_time = current_time
-        
-        # Calculate error
-        error = target_temp - filtered_temp
-        
-        # Apply deadband to error
-        deadband_error = self.apply_deadband(error)
-        
-        # Calculate PID components
-        p_term = kp * deadband_error
+        now = time.monotonic()
+        dt = now - self.last_time
         
-        # Enhanced integral management
-        self.error_sum = self.manage_integral_term(error, p_term, dt)
-        i_term = ki * self.error_sum
-        
-        # Derivative term (on measurement, not error, to avoid derivative kick)
-        d_term = -kd * (filtered_temp - self.last_error) / dt if dt > 0 else 0
-        self.last_error = filtered_temp
-        
-        # Calculate total output
-        output = p_term + i_term + d_term
+        # Deadband, P/I/D terms and anti-windup run in the compiled kernel
+        # (see _pid_kernel.py):
+        # 1. error sign change detection & integral reset
+        # 2. conditional integration (only while the P term isn't saturated)
+        # 3. integral term clamping
+        prev_error_sign = self.prev_error_sign
+        last_temp = self.last_error
+        if last_temp is None:
+            last_temp = filtered_temp  # no derivative on the first sample
+        (error_sum, d_filt, error_sign, output, integral_reset,
+         error, deadband_error, p_term, i_term, d_term) = pid_step(
+            filtered_temp, target_temp, kp, ki, kd, dt,
+            self.error_sum, last_temp, self._d_filt, prev_error_sign,
+            self.deadband, self.max_integral, self.reset_integral_threshold, self.conditional_integration,
+            self._inv_dt, self._d_alpha
+        )
+        if integral_reset:
+            log.info("🔄 Error changed sign significantly (%d to %d). Resetting integral term.",
+                     prev_error_sign, error_sign)
         
         # Apply output filtering to smooth control response
         filtered_output = self.filter_output(output)
         
-        # Debug output
-        print(f"Current: {current_temp:.2f}°C (Filtered: {filtered_temp:.2f}°C), Target: {target_temp:.2f}°C")
-        print(f"Error: {error:.2f}°C, Deadband Error: {deadband_error:.2f}°C")
-        print(f"P: {p_term:.2f}, I: {i_term:.2f} (sum={self.error_sum:.2f}), D: {d_term:.2f}")
-        print(f"Raw Output: {output:.2f}, Filtered Output: {filtered_output:.2f}")
-        
         # Convert to binary output for heating control
         heater_on = filtered_output > 0
         
-        # Track heater state duration
-        if heater_on != self.last_heater_state:
-            if self.heater_state_duration < self.min_heater_duration:
+        # Track heater state duration (time spent in the current state, including this tick)
+        last_heater_state = self.last_heater_state
+        state_duration = self.heater_state_duration + dt
+        held = ""
+        if heater_on != last_heater_state:
+            if state_duration < self.min_heater_duration:
                 # Keep current state if we haven't met minimum duration
-                heater_on = self.last_heater_state
-                print(f"Minimum state duration not met. Maintaining current state.")
+                heater_on = last_heater_state
+                held = " - minimum state duration not met, maintaining current state"
             else:
                 # Reset duration counter for state change
-                self.heater_state_duration = 0
-                self.last_heater_state = heater_on
-        else:
-            # Increment duration for same state
-            self.heater_state_duration += dt
+                state_duration = 0
+                last_heater_state = heater_on
+        
+        # Everything above works on locals; write the controller state back once
+        self.last_time = now
+        self.error_sum = error_sum
+        self._d_filt = d_filt
+        self.prev_error_sign = error_sign
+        self.last_error = filtered_temp
+        self.heater_state_duration = state_duration
+        self.last_heater_state = last_heater_state
         
-        # Debug the actual decision
-        print(f"Decision: Heater {'ON' if heater_on else 'OFF'} (State Duration: {self.heater_state_duration:.1f}s)")
-        print("-" * 40)
+        # Debug output (only formatted when --verbose enables DEBUG)
+        log.debug(TICK_LOG_FORMAT,
+                  current_temp, filtered_temp, target_temp,
+                  error, deadband_error,
+                  p_term, i_term, error_sum, d_term,
+                  output, filtered_output,
+                  'ON' if heater_on else 'OFF', state_duration, held)
         
         return heater_on
     
-    def enable_auto_control(self):
+    def reset_derivative(self):
+        """
+        Forget the previous sample after a missed or skipped tick. The derivative
+        assumes one nominal interval between samples, so differentiating across
+        the gap would feed a spike into the filtered D term.
+        """
+        self.last_error = None
+        self._d_filt = 0.0
+    
+    async def enable_auto_control(self):
         """
         Enables automatic control mode in the simulation
         """
         try:
-            response = requests.post(
-                f"{self.base_url}/api/auto_control",
-                json={"enabled": True}
+            response = await self.client.post(
+                self._auto_url,
+                content=self._auto_body,
+                headers=self._json_headers
             )
-            return response.json()
-        except requests.RequestException as e:
-            print(f"Error enabling auto control: {e}")
+            if response.status_code != 200:
+                log.warning("Error enabling auto control: HTTP %d", response.status_code)
+                return None
+            return orjson.loads(response.content)
+        except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+            log.warning("Error enabling auto control: %s", e)
             return None
     
-    def run(self):
+    async def run(self):
         """
         Main control loop
         """
-        print("Starting Enhanced PID controller with improved anti-windup protection...")
-        print("Anti-windup strategies active:")
-        print("1. Error sign change detection & reset")
-        print("2. Conditional integration")
-        print("3. Integral term clamping")
-        print("4. Filtered temperature and output")
-        print("-" * 60)
+        log.info("Starting Enhanced PID controller with improved anti-windup protection...")
+        log.info("Anti-windup strategies active:")
+        log.info("1. Error sign change detection & reset")
+        log.info("2. Conditional integration")
+        log.info("3. Integral term clamping")
+        log.info("4. Filtered temperature and output")
+        log.info("-" * 60)
         
         self.running = True
-        self.enable_auto_control()
+        
+        loop = asyncio.get_running_loop()
+        restore_signals = []
+        keepalive_task = None
         
         try:
+            restore_signals = self.install_signal_handlers(loop)
+            await self.preconnect()
+            keepalive_task = asyncio.create_task(self.keepalive())
+            await self.enable_auto_control()
+            self._next_tick = time.monotonic()
+            
+            heater_on = None  # decision to send with the next tick
             while self.running:
-                # Get current state
-                state = self.get_state()
+                # Send the previous decision and get the current state
+                state = await self.tick(heater_on)
+                heater_on = None
                 if not state:
-                    time.sleep(self.update_interval)
+                    self._last_cmd = None  # the command may not have arrived
+                    self.reset_derivative()
+                    await self.wait_next_tick()
                     continue
                 
                 # Skip if auto control is disabled
-                if not state['auto_control']:
-                    print("Auto control disabled. Waiting...")
-                    time.sleep(self.update_interval)
+                if not state.auto_control:
+                    log.debug("Auto control disabled. Waiting...")
+                    self._last_cmd = None
+                    self.reset_derivative()
+                    await self.wait_next_tick()
                     continue
                 
-                # Calculate PID output
+                # Calculate PID output; it goes out with the next tick
                 heater_on = self.pid_calculation(state)
+                if heater_on is self._last_cmd and self._ticks_since_cmd < self.command_resend_ticks:
+                    heater_on = None  # same as last command - nothing to send
+                    self._ticks_since_cmd += 1
+                else:
+                    self._last_cmd = heater_on
+                    self._ticks_since_cmd = 0
                 
-                # Send control signal
-                self.set_heater(heater_on)
-                
-                # Wait for next update
-                time.sleep(self.update_interval)
+                await self.wait_next_tick()
         
-        except KeyboardInterrupt:
-            print("\nStopping PID controller...")
         finally:
+            log.info("Stopping PID controller...")
             self.running = False
+            for restore in restore_signals:
+                restore()
+            if keepalive_task is not None:
+                keepalive_task.cancel()
+            await self.client.aclose()
+    
+    def install_signal_handlers(self, loop):
+        """
+        Make SIGINT/SIGTERM stop the loop, so it exits through run()'s finally
+        and closes the connection pool cleanly. Returns callables that undo it.
+        """
+        restore = []
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+                restore.append(lambda sig=sig: loop.remove_signal_handler(sig))
+            except (NotImplementedError, RuntimeError):
+                # Windows event loops (and loops off the main thread) don't
+                # support add_signal_handler; use a plain handler instead
+                try:
+                    previous = signal.signal(sig, lambda *_: loop.call_soon_threadsafe(self.stop))
+                except ValueError:
+                    continue  # not the main thread - leave signals to the caller
+                restore.append(lambda sig=sig, previous=previous: signal.signal(sig, previous))
+        return restore
+    
+    async def wait_next_tick(self):
+        """
+        Sleep until the next tick deadline, so time spent on requests doesn't stretch the period
+        """
+        self._next_tick += self.update_interval
+        sleep_for = self._next_tick - time.monotonic()
+        if sleep_for > 0:
+            await asyncio.sleep(sleep_for)
+        else:
+            # Overran the tick - start a fresh schedule instead of bursting to catch up
+            self._next_tick = time.monotonic()
     
     def stop(self):
         """
@@ -247,10 +416,6 @@ class PIDController:
         self.running = False
 
 
-def signal_handler(sig, frame):
-    print("\nStopping PID controller...")
-    sys.exit(0)
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Enhanced PID Controller with Anti-Windup Protection")
     parser.add_argument("--url", default=DEFAULT_URL, help="URL of the Flask app")
@@ -264,11 +429,22 @@ if __name__ == "__main__":
                         help="Minimum heater state duration in seconds")
     parser.add_argument("--max-integral", type=float, default=15.0,
                         help="Maximum integral term value (anti-windup)")
+    parser.add_argument("--http2", action="store_true",
+                        help="Use HTTP/2 when the URL is https:// (needs httpx[http2])")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Log the per-tick PID calculation")
     
     args = parser.parse_args()
     
-    # Register signal handler for clean exit
-    signal.signal(signal.SIGINT, signal_handler)
+    # Log records are queued by the control loop and written to stdout by a
+    # listener thread, so terminal I/O never stalls a tick
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    logging.basicConfig(level=logging.INFO, format="%(message)s",
+                        handlers=[logging.handlers.QueueHandler(log_queue)])
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # httpx logs every request at INFO
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
     
     # Create and run controller
     controller = PIDController(
@@ -276,7 +452,12 @@ if __name__ == "__main__":
         args.interval, 
         filter_samples=args.filter,
         deadband=args.deadband,
-        min_heater_duration=args.min_duration
+        min_heater_duration=args.min_duration,
+        http2=args.http2
     )
     controller.max_integral = args.max_integral
-    controller.run()
\ No newline at end of file
+    log_listener.start()
+    try:
+        asyncio.run(controller.run())
+    finally:
+        log_listener.stop()  # flushes anything still queued
\ No newline at end of file
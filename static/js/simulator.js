@@ -232,19 +232,20 @@ function updateUI(state) {
         }
     }
     
-    // Update chart
-    if (state.history && state.history.length > 0) {
+    // Update chart (history arrives as parallel arrays: time, temperature, heater_on, target)
+    const history = state.history;
+    if (history && history.time.length > 0) {
         // Update temperature data with heater status
-        tempChart.data.datasets[0].data = state.history.map(point => ({
-            x: point.time,
-            y: point.temperature,
-            heaterOn: point.heater_on  // Include heater status for coloring
+        tempChart.data.datasets[0].data = history.time.map((t, i) => ({
+            x: t,
+            y: history.temperature[i],
+            heaterOn: history.heater_on[i]  // Include heater status for coloring
         }));
         
         // Update target line
-        tempChart.data.datasets[1].data = state.history.map(point => ({
-            x: point.time,
-            y: point.target
+        tempChart.data.datasets[1].data = history.time.map((t, i) => ({
+            x: t,
+            y: history.target[i]
         }));
         
         tempChart.update('none');  // Update without animation for smoother experience
@@ -260,11 +261,12 @@ function updateUI(state) {
 function calculatePerformanceMetrics(state) {
     const target = state.target_temp;
     const current = state.current_temp;
-    const history = state.history;
+    const times = state.history.time;
+    const temps = state.history.temperature;
     
     // If this is the first time auto control is enabled, reset metrics
     if (!simulationStartTime && state.auto_control) {
-        simulationStartTime = history[history.length - 1].time;
+        simulationStartTime = times[times.length - 1];
         maxTemperatureReached = current;
         settlingDetected = false;
         overshotDetected = false;
@@ -287,22 +289,22 @@ function calculatePerformanceMetrics(state) {
     
     if (!settlingDetected) {
         // Check last 10 points to see if we've settled
-        const lastPoints = history.slice(-10);
-        const allWithinRange = lastPoints.every(point => 
-            Math.abs(point.temperature - target) <= settlingThreshold
+        const lastTemps = temps.slice(-10);
+        const allWithinRange = lastTemps.every(temperature => 
+            Math.abs(temperature - target) <= settlingThreshold
         );
         
-        if (allWithinRange && lastPoints.length === 10) {
+        if (allWithinRange && lastTemps.length === 10) {
             settlingDetected = true;
-            settlingTimeValue = (lastPoints[0].time - simulationStartTime).toFixed(1);
+            settlingTimeValue = (times[times.length - 10] - simulationStartTime).toFixed(1);
             settlingTime.textContent = settlingTimeValue + ' seconds';
         }
     }
     
     // Calculate steady-state error
-    if (history.length > 20) {
-        const lastPoints = history.slice(-20);
-        const avgTemp = lastPoints.reduce((sum, point) => sum + point.temperature, 0) / lastPoints.length;
+    if (temps.length > 20) {
+        const lastTemps = temps.slice(-20);
+        const avgTemp = lastTemps.reduce((sum, temperature) => sum + temperature, 0) / lastTemps.length;
         const error = Math.abs(avgTemp - target).toFixed(2);
         steadyError.textContent = error + '°C';
     }